@@ -49,7 +49,7 @@ class SomeCharm(...):
 
 To kick off the rolling restart, emit this library's AcquireLock event. The simplest way
 to do so would be with an action, though it might make sense to acquire the lock in
-response to another event. 
+response to another event.
 
 ```python
     def _on_trigger_restart(self, event):
@@ -69,10 +69,76 @@ restart. (An operator might take advantage of this fact to recover from a failed
 operation without restarting workloads that were able to successfully restart -- simply
 omit the successful units from a subsequent run-action call.)
 
+If the rolling operation puts load on a shared backend (for example, restarted units all
+warming their caches from the same storage), the leader can be asked to space out its
+grants by passing a minimum interval, in seconds, between two consecutive grants:
+
+```python
+        self.restart_manager = RollingOpsManager(
+            charm=self, relation="restart", callback=self._restart, min_interval=60
+        )
+```
+
+Grants that arrive too early are not lost: the leader re-evaluates them on the next
+update-status hook. The effective spacing is therefore at least `min_interval`, and at most
+roughly `min_interval` plus one update-status-hook-interval.
+
+Every hand-off normally costs two hook round trips: the holder releases the lock, the
+leader notices and grants it to the next unit, and only then does that unit run. Passing
+`pipeline=True` asks the leader to publish the order in which it will grant the lock. A
+unit that sees the unit ahead of it in that order release the lock starts right away, and
+the leader learns about it afterwards. Each unit runs at most once per published order,
+and the leader still grants strictly in that order, so no two units ever run at the same
+time. A unit that asks for the lock again after its turn waits for the next order.
+Pipelining is ignored when `min_interval` is set, as it would bypass the rate limit.
+
+Several applications can also share one lock, so that they roll in parallel without taking
+down more units at once than the model can afford. One charm acts as the coordinator: it
+provides a regular relation, and hands out locks to units of every related application,
+within a model-wide budget and a per-application limit:
+
+coordinator/metadata.yaml
+```yaml
+provides:
+    rolling-ops:
+        interface: rolling_op_coordinator
+```
+
+coordinator/src/charm.py
+```python
+        self.coordinator = RollingOpsCoordinator(
+            charm=self, relation="rolling-ops", budget=2, limits={"kafka": 1, "zookeeper": 1}
+        )
+```
+
+The charms being rolled require that relation, and name it when creating their manager.
+They keep their peer relation, which is still used when no coordinator is related:
+
+some-charm/metadata.yaml
+```yaml
+requires:
+    coordinator:
+        interface: rolling_op_coordinator
+        limit: 1
+```
+
+```python
+        self.restart_manager = RollingOpsManager(
+            charm=self, relation="restart", callback=self._restart, coordinator="coordinator"
+        )
+```
+
+Avoid adding or removing the coordinator relation in the middle of a rolling operation:
+locks requested through one path are not carried over to the other. Rate limiting and
+pipelining only apply to the peer relation.
+
 """
+
+import json
 import logging
+import time
 from enum import Enum
-from typing import AnyStr, Callable, Optional
+from typing import AnyStr, Callable, Dict, List, Optional
 
 from ops.charm import ActionEvent, CharmBase, RelationChangedEvent
 from ops.framework import EventBase, Object
@@ -88,7 +154,7 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 3
+LIBPATCH = 6
 
 
 class LockNoRelationError(Exception):
@@ -140,6 +206,14 @@ class Lock:
             status: 'acquire|release'
         <application>:
            <unit n>: 'granted|None'
+           last_grant: <timestamp of the latest grant, if rate limiting is enabled>
+           chain: <JSON list of unit names, in grant order, if pipelining is enabled>
+           chain_id: <counter identifying the current chain>
+
+    The same structure is used on the relation between a coordinator and the applications
+    it coordinates, except that the application data is the coordinator's, and lists the
+    units of the remote application by unit name. (The peer relation keys units by their
+    Python representation, which is kept for compatibility with existing deployments.)
 
     Note that this class makes no attempts to timestamp the locks and thus handle multiple
     requests in a row. If a unit re-requests a lock before being granted the lock, the
@@ -148,15 +222,23 @@ class Lock:
 
     """
 
-    def __init__(self, manager, unit=None):
+    def __init__(self, manager, unit=None, relation=None, app=None):
 
-        self.relation = manager.model.relations[manager.name][0]
+        self.relation = relation or manager.model.get_relation(manager.name)
         if not self.relation:
             # TODO: defer caller in this case (probably just fired too soon).
             raise LockNoRelationError()
 
         self.unit = unit or manager.model.unit
-        self.app = manager.model.app
+        # The application that grants locks: ours, unless a coordinator does it for us.
+        self.app = app or manager.model.app
+
+        if self.app.name == self.unit.app.name:
+            self._key = str(self.unit)
+        else:
+            # Both ends of a cross-app relation may run different versions of ops, so don't
+            # depend on how they represent a unit.
+            self._key = self.unit.name
 
     @property
     def _state(self) -> LockState:
@@ -170,9 +252,7 @@ class Lock:
 
         """
         unit_state = LockState(self.relation.data[self.unit].get("state", LockState.IDLE.value))
-        app_state = LockState(
-            self.relation.data[self.app].get(str(self.unit), LockState.IDLE.value)
-        )
+        app_state = LockState(self.relation.data[self.app].get(self._key, LockState.IDLE.value))
 
         if app_state == LockState.GRANTED and unit_state == LockState.RELEASE:
             # Active release request.
@@ -197,10 +277,10 @@ class Lock:
             self.relation.data[self.unit].update({"state": state.value})
 
         if state == LockState.GRANTED:
-            self.relation.data[self.app].update({str(self.unit): state.value})
+            self.relation.data[self.app].update({self._key: state.value})
 
         if state is LockState.IDLE:
-            self.relation.data[self.app].update({str(self.unit): state.value})
+            self.relation.data[self.app].update({self._key: state.value})
 
     def acquire(self):
         """Request that a lock be acquired."""
@@ -281,7 +361,15 @@ class ProcessLocks(EventBase):
 class RollingOpsManager(Object):
     """Emitters and handlers for rolling ops."""
 
-    def __init__(self, charm: CharmBase, relation: AnyStr, callback: Callable):
+    def __init__(
+        self,
+        charm: CharmBase,
+        relation: AnyStr,
+        callback: Callable,
+        min_interval: float = 0,
+        pipeline: bool = False,
+        coordinator: Optional[str] = None,
+    ):
         """Register our custom events.
 
         params:
@@ -291,6 +379,15 @@ class RollingOpsManager(Object):
                 distinct from other instances that may be hanlding other events.
             callback: a closure to run when we have a lock. (It must take a CharmBase object and
                 EventBase object as args.)
+            min_interval: minimum number of seconds the leader waits between two
+                consecutive grants. Grants deferred by this limit are re-evaluated on
+                update-status. Defaults to 0 (no rate limiting).
+            pipeline: let a waiting unit start as soon as the unit granted the lock before
+                it releases, instead of waiting for the leader to grant the lock. Ignored if
+                min_interval is set. Defaults to False.
+            coordinator: name of a regular relation to a charm running a
+                RollingOpsCoordinator. While that relation exists, locks are requested from
+                the coordinator instead of from our leader. Defaults to None.
         """
         # "Inherit" from the charm's class. This gives us access to the framework as
         # self.framework, as well as the self.model shortcut.
@@ -298,6 +395,9 @@ class RollingOpsManager(Object):
 
         self.name = relation
         self._callback = callback
+        self.min_interval = min_interval
+        self.pipeline = pipeline and not min_interval
+        self.coordinator = coordinator
         self.charm = charm  # Maintain a reference to charm, so we can emit events.
 
         charm.on.define_event("{}_run_with_lock".format(self.name), RunWithLock)
@@ -309,6 +409,24 @@ class RollingOpsManager(Object):
         self.framework.observe(charm.on[self.name].acquire_lock, self._on_acquire_lock)
         self.framework.observe(charm.on[self.name].run_with_lock, self._on_run_with_lock)
         self.framework.observe(charm.on[self.name].process_locks, self._on_process_locks)
+        self.framework.observe(charm.on.update_status, self._on_update_status)
+
+        if self.coordinator:
+            self.framework.observe(
+                charm.on[self.coordinator].relation_changed, self._on_relation_changed
+            )
+
+    def _coordinated(self) -> bool:
+        """Check whether our locks are handed out by a coordinator."""
+        return bool(self.coordinator and self.model.get_relation(self.coordinator))
+
+    def _lock(self) -> Lock:
+        """Return this unit's lock, from the coordinator relation if there is one."""
+        if self._coordinated():
+            relation = self.model.get_relation(self.coordinator)
+            return Lock(self, relation=relation, app=relation.app)
+
+        return Lock(self)
 
     def _callback(self: CharmBase, event: EventBase) -> None:
         """Placeholder for the function that actually runs our event.
@@ -326,11 +444,15 @@ class RollingOpsManager(Object):
         Then, if we are the leader, fire off a process locks event.
 
         """
-        lock = Lock(self)
+        lock = self._lock()
 
         if lock.is_pending():
             self.model.unit.status = WaitingStatus("Awaiting {} operation".format(self.name))
 
+            if not self._coordinated() and self._predecessor_released():
+                # Don't wait for the leader to hand us the lock; it will catch up.
+                self.charm.on[self.name].run_with_lock.emit()
+
         if lock.is_held():
             self.charm.on[self.name].run_with_lock.emit()
 
@@ -343,7 +465,7 @@ class RollingOpsManager(Object):
         Runs only on the leader. Updates the status of all locks.
 
         """
-        if not self.model.unit.is_leader():
+        if not self.model.unit.is_leader() or self._coordinated():
             return
 
         pending = []
@@ -366,22 +488,142 @@ class RollingOpsManager(Object):
         # If we reach this point, and we have pending units, we want to grant a lock to
         # one of them.
         if pending:
+            if not self._grant_allowed():
+                self.model.app.status = WaitingStatus("Rate limiting rolling {}".format(self.name))
+                return
+
             self.model.app.status = MaintenanceStatus("Beginning rolling {}".format(self.name))
-            lock = pending[-1]
+            self._record_grant()
+            lock = self._next_in_chain(pending)
             lock.grant()
             if lock.unit == self.model.unit:
                 # It's time for the leader to run with lock.
                 self.charm.on[self.name].run_with_lock.emit()
             return
 
+        self._clear_chain()
         self.model.app.status = ActiveStatus()
 
+    def _next_in_chain(self, pending: List[Lock]) -> Lock:
+        """Pick the next lock to grant, following the published chain if there is one.
+
+        A unit further down the chain may already be running, having seen its predecessor
+        release the lock, so we must never grant out of chain order. Units that requested
+        the lock after the chain was published, or that already ran as part of it and asked
+        again, wait for a new chain.
+        """
+        if not self.pipeline:
+            return pending[-1]
+
+        relation = self.model.get_relation(self.name)
+        chain = json.loads(relation.data[self.model.app].get("chain") or "[]")
+        by_name = {lock.unit.name: lock for lock in pending if not self._ran_in_chain(lock.unit)}
+
+        for name in chain:
+            if name in by_name:
+                return by_name[name]
+
+        # Chain exhausted. Publish a new one, in the order we would have granted anyway.
+        chain_id = int(relation.data[self.model.app].get("chain_id") or 0) + 1
+        chain = [lock.unit.name for lock in reversed(pending)]
+        relation.data[self.model.app].update(
+            {"chain": json.dumps(chain), "chain_id": str(chain_id)}
+        )
+        return pending[-1]
+
+    def _clear_chain(self):
+        """Drop the chain once every unit in it has run."""
+        if not self.pipeline:
+            return
+
+        relation = self.model.get_relation(self.name)
+        if relation.data[self.model.app].get("chain"):
+            relation.data[self.model.app].update({"chain": ""})
+
+    def _predecessor_released(self) -> bool:
+        """Check whether the unit ahead of us in the chain has finished with the lock.
+
+        The predecessor counts as finished if it released a lock granted by the leader, or
+        if it ran ahead of a grant itself, as part of the current chain.
+        """
+        if not self.pipeline or self.model.unit.is_leader():
+            # The leader grants itself the lock without a round trip anyway.
+            return False
+
+        relation = self.model.get_relation(self.name)
+        chain = json.loads(relation.data[self.model.app].get("chain") or "[]")
+        me = self.model.unit.name
+        if me not in chain or chain.index(me) == 0:
+            return False
+
+        if self._ran_in_chain(self.model.unit):
+            # We asked again after our turn. Running ahead now could overlap with our
+            # successor, so wait for the leader to put us in a new chain.
+            return False
+
+        name = chain[chain.index(me) - 1]
+        predecessor = [unit for unit in relation.units if unit.name == name]
+        if not predecessor:
+            # Departed, or not visible yet. Leave it to the leader.
+            return False
+
+        lock = Lock(self, unit=predecessor[0])
+        if lock.release_requested():
+            return True
+
+        released = relation.data[predecessor[0]].get("state") == LockState.RELEASE.value
+        return released and self._ran_in_chain(predecessor[0])
+
+    def _ran_in_chain(self, unit) -> bool:
+        """Check whether a unit has already run as part of the current chain."""
+        relation = self.model.get_relation(self.name)
+        chain_id = relation.data[self.model.app].get("chain_id")
+        return bool(chain_id) and relation.data[unit].get("chain_id") == chain_id
+
+    def _grant_allowed(self) -> bool:
+        """Check whether enough time has passed since the last grant."""
+        if not self.min_interval:
+            return True
+
+        relation = self.model.get_relation(self.name)
+        last_grant = float(relation.data[self.model.app].get("last_grant", 0))
+        return time.time() - last_grant >= self.min_interval
+
+    def _record_grant(self):
+        """Note the time of a grant, so that the next one can be spaced out."""
+        if not self.min_interval:
+            return
+
+        relation = self.model.get_relation(self.name)
+        relation.data[self.model.app].update({"last_grant": str(time.time())})
+
+    def _on_update_status(self: CharmBase, event: EventBase):
+        """Give the leader a chance to issue grants held back by the rate limit."""
+        if not self.min_interval or not self.model.get_relation(self.name):
+            return
+
+        if self._coordinated():
+            return
+
+        if self.model.unit.is_leader():
+            self.charm.on[self.name].process_locks.emit()
+
     def _on_acquire_lock(self: CharmBase, event: ActionEvent):
         """Request a lock."""
         try:
-            Lock(self).acquire()  # Updates relation data
+            lock = self._lock()
+            if (self.pipeline or self._coordinated()) and lock.release_requested():
+                # Our last release has not been seen yet. Asking again now would turn the
+                # stale grant into a fresh one, and let us run alongside other units.
+                logger.debug("Previous {} lock not cleared yet. Deferring.".format(self.name))
+                event.defer()
+                return
+
+            lock.acquire()  # Updates relation data
             # emit relation changed event in the edge case where aquire does not
             relation = self.model.get_relation(self.name)
+            if relation is None:
+                raise LockNoRelationError()
 
             # persist callback override for eventual run
             relation.data[self.charm.unit].update({"callback_override": event.callback_override})
@@ -391,7 +633,7 @@ class RollingOpsManager(Object):
             event.defer()
 
     def _on_run_with_lock(self: CharmBase, event: RunWithLock):
-        lock = Lock(self)
+        lock = self._lock()
         self.model.unit.status = MaintenanceStatus("Executing {} operation".format(self.name))
         relation = self.model.get_relation(self.name)
 
@@ -403,9 +645,114 @@ class RollingOpsManager(Object):
         callback(event)
 
         lock.release()  # Updates relation data
+        if self.pipeline and not self._coordinated():
+            # Let our successor tell a release from this chain apart from a stale one.
+            relation.data[self.charm.unit].update(
+                {"chain_id": relation.data[self.model.app].get("chain_id", "")}
+            )
         if lock.unit == self.model.unit:
             self.charm.on[self.name].process_locks.emit()
 
         # cleanup old callback overrides
         relation.data[self.charm.unit].update({"callback_override": ""})
         self.model.unit.status = ActiveStatus()
+
+
+class RollingOpsCoordinator(Object):
+    """Hands out locks to the units of several applications, within a shared budget.
+
+    Each application being rolled relates to the coordinator over a regular relation, and
+    runs a RollingOpsManager with its coordinator argument set. The coordinator's leader
+    grants locks to as many pending units as the budget allows, across all relations, while
+    never letting more than an application's limit of its units run at the same time.
+    """
+
+    def __init__(
+        self,
+        charm: CharmBase,
+        relation: str,
+        budget: int = 1,
+        limits: Optional[Dict[str, int]] = None,
+        default_limit: int = 1,
+    ):
+        """Watch the coordinator relation.
+
+        params:
+            charm: the charm we are attaching this to.
+            relation: the name of the relation, in the metadata.yaml, that the coordinated
+                applications relate to.
+            budget: maximum number of units, across all related applications, that may hold
+                a lock at the same time.
+            limits: maximum number of units of a given application, by application name,
+                that may hold a lock at the same time.
+            default_limit: the limit for applications that are not listed in limits.
+        """
+        super().__init__(charm, relation)
+
+        self.name = relation
+        self.budget = budget
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.charm = charm
+
+        self.framework.observe(charm.on[self.name].relation_changed, self._on_process_locks)
+        self.framework.observe(charm.on[self.name].relation_departed, self._on_process_locks)
+        # A new leader, or one that missed a change, must not leave pending requests waiting
+        # for some related unit to write to the relation again.
+        self.framework.observe(charm.on.leader_elected, self._on_process_locks)
+        self.framework.observe(charm.on.update_status, self._on_process_locks)
+
+    def _limit(self, app_name: str) -> int:
+        """Return the number of units of an application that may run at once."""
+        return self.limits.get(app_name, self.default_limit)
+
+    def _on_process_locks(self, event: EventBase):
+        """Process the locks of every related application.
+
+        Runs only on the leader. Clears released locks, then grants pending ones until the
+        budget, or the limit of the requesting application, is exhausted.
+
+        """
+        if not self.model.unit.is_leader():
+            return
+
+        held: Dict[str, int] = {}
+        pending = []
+
+        for relation in sorted(self.model.relations[self.name], key=lambda r: r.id):
+            if relation.app is None:
+                # Remote application is going away.
+                continue
+
+            held.setdefault(relation.app.name, 0)
+            for unit in sorted(relation.units, key=lambda u: u.name):
+                lock = Lock(self, unit=unit, relation=relation)
+
+                if lock.is_held():
+                    held[relation.app.name] += 1
+
+                if lock.release_requested():
+                    lock.clear()  # Updates relation data
+
+                if lock.is_pending():
+                    pending.append(lock)
+
+        for lock in pending:
+            if sum(held.values()) >= self.budget:
+                break
+
+            app_name = lock.relation.app.name
+            if held[app_name] >= self._limit(app_name):
+                continue
+
+            lock.grant()  # Updates relation data
+            held[app_name] += 1
+
+        running = sum(held.values())
+        if running:
+            self.model.app.status = MaintenanceStatus(
+                "Coordinating {} ({}/{} units)".format(self.name, running, self.budget)
+            )
+            return
+
+        self.model.app.status = ActiveStatus()
@@ -14,14 +14,24 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import json
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
+from charms.rolling_ops.v0.rollingops import RollingOpsManager
+from ops.charm import CharmBase
 from ops.model import ActiveStatus, MaintenanceStatus, WaitingStatus
 from ops.testing import Harness
 
 from charm import CharmRollingOpsCharm
 
+PEER_METADATA = """
+name: rolling-ops
+peers:
+    restart:
+        interface: rolling_op
+"""
+
 
 class TestCharm(unittest.TestCase):
     def setUp(self):
@@ -85,3 +95,265 @@ class TestCharm(unittest.TestCase):
 
         self.assertEqual(self.harness.charm.model.app.status, ActiveStatus())
         self.assertEqual(self.harness.charm.model.unit.status, ActiveStatus())
+
+    @patch("charms.rolling_ops.v0.rollingops.time")
+    def test_rate_limit(self, _time):
+        # Space grants at least a minute apart.
+        _time.time.return_value = 1000.0
+        self.harness.charm.restart_manager.min_interval = 60
+
+        self.harness.set_leader(True)
+        self.harness.add_relation_unit(0, "rolling-ops/1")
+        self.harness.update_relation_data(0, "rolling-ops/0", {"state": "acquire"})
+        self.harness.update_relation_data(0, "rolling-ops/1", {"state": "acquire"})
+
+        unit_0 = self.harness.charm.model.get_unit("rolling-ops/0")
+        unit_1 = self.harness.charm.model.get_unit("rolling-ops/1")
+        rel_data = self.harness.charm.model.relations["restart"][0].data
+
+        # Unit 1 gets the first grant straight away.
+        self.assertEqual(rel_data[self.harness.model.app][str(unit_1)], "granted")
+        self.assertEqual(rel_data[self.harness.model.app]["last_grant"], "1000.0")
+
+        # Unit 1 releases the lock, but the next grant is held back.
+        _time.time.return_value = 1030.0
+        self.harness.update_relation_data(0, "rolling-ops/1", {"state": "release"})
+
+        self.assertEqual(rel_data[self.harness.model.app][str(unit_1)], "idle")
+        self.assertEqual(rel_data[unit_0]["state"], "acquire")
+        self.assertEqual(
+            self.harness.charm.model.app.status, WaitingStatus("Rate limiting rolling restart")
+        )
+
+        # Still too early on the next update-status.
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(rel_data[unit_0]["state"], "acquire")
+
+        # Once the interval has passed, update-status lets unit 0 run.
+        _time.time.return_value = 1060.0
+        self.harness.charm.on.update_status.emit()
+
+        self.assertEqual(rel_data[unit_0]["state"], "release")
+        self.assertEqual(rel_data[self.harness.model.app][str(unit_0)], "idle")
+        self.assertTrue(self.harness.charm._stored.restarted)
+        self.assertEqual(self.harness.charm.model.app.status, ActiveStatus())
+
+    def test_pipeline_leader(self):
+        self.harness.charm.restart_manager.pipeline = True
+
+        # Everyone requests the lock before the leader gets to look at it.
+        self.harness.add_relation_unit(0, "rolling-ops/1")
+        self.harness.add_relation_unit(0, "rolling-ops/2")
+        self.harness.update_relation_data(0, "rolling-ops/0", {"state": "acquire"})
+        self.harness.update_relation_data(0, "rolling-ops/1", {"state": "acquire"})
+        self.harness.update_relation_data(0, "rolling-ops/2", {"state": "acquire"})
+        self.harness.set_leader(True)
+        self.harness.charm.on["restart"].process_locks.emit()
+
+        app_data = self.harness.charm.model.relations["restart"][0].data[self.harness.model.app]
+
+        # The leader publishes the grant order, with itself last, and grants the head.
+        chain = json.loads(app_data["chain"])
+        first, second = chain[0], chain[1]
+        self.assertEqual(chain[2], "rolling-ops/0")
+        self.assertEqual(app_data["chain_id"], "1")
+        first_key = str(self.harness.charm.model.get_unit(first))
+        second_key = str(self.harness.charm.model.get_unit(second))
+        self.assertEqual(app_data[first_key], "granted")
+
+        # The second unit sees the first release, and runs before the leader grants it.
+        self.harness.update_relation_data(0, second, {"state": "release", "chain_id": "1"})
+        self.assertEqual(app_data[first_key], "granted")
+        self.assertNotEqual(app_data.get(second_key), "granted")
+
+        # The first unit's release reaches the leader. The second unit has already run,
+        # so the leader moves on to itself, without ever granting the second unit.
+        self.harness.update_relation_data(0, first, {"state": "release", "chain_id": "1"})
+        self.assertEqual(app_data[first_key], "idle")
+        self.assertNotEqual(app_data.get(second_key), "granted")
+        self.assertEqual(app_data[str(self.harness.charm.model.unit)], "idle")
+        self.assertTrue(self.harness.charm._stored.restarted)
+
+        # The chain is dropped once everyone has run.
+        self.assertNotIn("chain", app_data)
+        self.assertEqual(self.harness.charm.model.app.status, ActiveStatus())
+
+    def test_pipeline_follower(self):
+        self.harness.charm.restart_manager.pipeline = True
+
+        self.harness.add_relation_unit(0, "rolling-ops/1")
+        unit_0 = self.harness.charm.model.get_unit("rolling-ops/0")
+        unit_1 = self.harness.charm.model.get_unit("rolling-ops/1")
+        self.harness.update_relation_data(0, "rolling-ops/0", {"state": "acquire"})
+        self.harness.update_relation_data(
+            0,
+            "rolling-ops",
+            {
+                str(unit_1): "granted",
+                "chain": json.dumps(["rolling-ops/1", "rolling-ops/0"]),
+                "chain_id": "3",
+            },
+        )
+
+        rel_data = self.harness.charm.model.relations["restart"][0].data
+        self.assertFalse(self.harness.charm._stored.restarted)
+
+        # Unit 1 releases. We run straight away, without waiting for a grant.
+        self.harness.update_relation_data(0, "rolling-ops/1", {"state": "release"})
+        self.assertTrue(self.harness.charm._stored.restarted)
+        self.assertEqual(rel_data[unit_0]["state"], "release")
+        self.assertEqual(rel_data[unit_0]["chain_id"], "3")
+
+        # The leader's late grant does not make us run a second time.
+        self.harness.charm._stored.restarted = False
+        self.harness.update_relation_data(
+            0, "rolling-ops", {str(unit_1): "idle", str(unit_0): "granted"}
+        )
+        self.assertFalse(self.harness.charm._stored.restarted)
+
+    def test_pipeline_acquire_again(self):
+        self.harness.charm.restart_manager.pipeline = True
+
+        self.harness.add_relation_unit(0, "rolling-ops/1")
+        self.harness.add_relation_unit(0, "rolling-ops/2")
+        unit_1 = self.harness.charm.model.get_unit("rolling-ops/1")
+        self.harness.update_relation_data(0, "rolling-ops/0", {"state": "acquire"})
+        self.harness.update_relation_data(
+            0,
+            "rolling-ops",
+            {
+                str(unit_1): "granted",
+                "chain": json.dumps(["rolling-ops/1", "rolling-ops/0", "rolling-ops/2"]),
+                "chain_id": "5",
+            },
+        )
+
+        # Unit 1 releases, and we run ahead of the leader.
+        self.harness.update_relation_data(0, "rolling-ops/1", {"state": "release"})
+        self.assertTrue(self.harness.charm._stored.restarted)
+
+        # We ask again while unit 2 may be running on the back of our release. Unit 1's
+        # release must not let us run a second time in the same chain.
+        self.harness.charm._stored.restarted = False
+        self.harness.charm.on["restart"].acquire_lock.emit()
+        self.harness.update_relation_data(0, "rolling-ops/2", {"state": "acquire"})
+
+        rel_data = self.harness.charm.model.relations["restart"][0].data
+        self.assertEqual(rel_data[self.harness.charm.model.unit]["state"], "acquire")
+        self.assertFalse(self.harness.charm._stored.restarted)
+
+    def test_pipeline_acquire_again_after_late_grant(self):
+        self.harness.charm.restart_manager.pipeline = True
+
+        self.harness.add_relation_unit(0, "rolling-ops/1")
+        self.harness.add_relation_unit(0, "rolling-ops/2")
+        unit_0 = self.harness.charm.model.unit
+        unit_1 = self.harness.charm.model.get_unit("rolling-ops/1")
+        self.harness.update_relation_data(0, "rolling-ops/0", {"state": "acquire"})
+        self.harness.update_relation_data(
+            0,
+            "rolling-ops",
+            {
+                str(unit_1): "granted",
+                "chain": json.dumps(["rolling-ops/1", "rolling-ops/0", "rolling-ops/2"]),
+                "chain_id": "5",
+            },
+        )
+
+        # We run ahead when unit 1 releases, and the leader's grant arrives late.
+        self.harness.update_relation_data(0, "rolling-ops/1", {"state": "release"})
+        self.assertTrue(self.harness.charm._stored.restarted)
+        self.harness.update_relation_data(
+            0, "rolling-ops", {str(unit_1): "idle", str(unit_0): "granted"}
+        )
+
+        # Asking again before the leader clears that grant must not run us a second time.
+        self.harness.charm._stored.restarted = False
+        self.harness.charm.on["restart"].acquire_lock.emit()
+
+        rel_data = self.harness.charm.model.relations["restart"][0].data
+        self.assertEqual(rel_data[unit_0]["state"], "release")
+        self.assertFalse(self.harness.charm._stored.restarted)
+
+        # Once the leader clears the grant, the deferred request goes through, and waits
+        # for a grant of its own.
+        self.harness.update_relation_data(0, "rolling-ops", {str(unit_0): "idle"})
+        self.harness.framework.reemit()
+        self.assertEqual(rel_data[unit_0]["state"], "acquire")
+        self.assertFalse(self.harness.charm._stored.restarted)
+
+    def test_pipeline_leader_acquire_again(self):
+        self.harness.charm.restart_manager.pipeline = True
+
+        self.harness.add_relation_unit(0, "rolling-ops/1")
+        self.harness.add_relation_unit(0, "rolling-ops/2")
+        self.harness.update_relation_data(0, "rolling-ops/0", {"state": "acquire"})
+        self.harness.update_relation_data(0, "rolling-ops/1", {"state": "acquire"})
+        self.harness.update_relation_data(0, "rolling-ops/2", {"state": "acquire"})
+        self.harness.set_leader(True)
+        self.harness.charm.on["restart"].process_locks.emit()
+
+        app_data = self.harness.charm.model.relations["restart"][0].data[self.harness.model.app]
+        first, second, _ = json.loads(app_data["chain"])
+        first_key = str(self.harness.charm.model.get_unit(first))
+        second_key = str(self.harness.charm.model.get_unit(second))
+
+        # The second unit runs ahead, then asks for the lock again.
+        self.harness.update_relation_data(0, second, {"state": "release", "chain_id": "1"})
+        self.harness.update_relation_data(0, second, {"state": "acquire"})
+
+        # Once the first unit releases, the leader skips the second unit, which already
+        # ran in this chain, and runs itself. The second unit gets a new chain of its own.
+        self.harness.update_relation_data(0, first, {"state": "release", "chain_id": "1"})
+        self.assertEqual(app_data[first_key], "idle")
+        self.assertEqual(app_data[str(self.harness.charm.model.unit)], "idle")
+        self.assertTrue(self.harness.charm._stored.restarted)
+
+        self.assertEqual(json.loads(app_data["chain"]), [second])
+        self.assertEqual(app_data["chain_id"], "2")
+        self.assertEqual(app_data[second_key], "granted")
+
+    def test_pipeline_disabled_by_min_interval(self):
+        class PipelineCharm(CharmBase):
+            def __init__(self, *args):
+                super().__init__(*args)
+                self.restart_manager = RollingOpsManager(
+                    charm=self,
+                    relation="restart",
+                    callback=self._restart,
+                    min_interval=60,
+                    pipeline=True,
+                )
+
+            def _restart(self, event):
+                pass
+
+        harness = Harness(PipelineCharm, meta=PEER_METADATA)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+
+        self.assertEqual(harness.charm.restart_manager.min_interval, 60)
+        self.assertFalse(harness.charm.restart_manager.pipeline)
+
+    def test_pipeline_stale_release(self):
+        self.harness.charm.restart_manager.pipeline = True
+
+        # Unit 1 released a lock in an earlier chain, and the leader has cleared it.
+        self.harness.add_relation_unit(0, "rolling-ops/1")
+        unit_1 = self.harness.charm.model.get_unit("rolling-ops/1")
+        self.harness.update_relation_data(
+            0, "rolling-ops/1", {"state": "release", "chain_id": "2"}
+        )
+        self.harness.update_relation_data(0, "rolling-ops/0", {"state": "acquire"})
+        self.harness.update_relation_data(
+            0,
+            "rolling-ops",
+            {
+                str(unit_1): "idle",
+                "chain": json.dumps(["rolling-ops/1", "rolling-ops/0"]),
+                "chain_id": "3",
+            },
+        )
+
+        # That old release must not let us run.
+        self.assertFalse(self.harness.charm._stored.restarted)
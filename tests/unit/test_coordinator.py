@@ -0,0 +1,200 @@
+# Copyright 2022 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Learn more about testing at: https://juju.is/docs/sdk/testing
+
+import unittest
+
+from charms.rolling_ops.v0.rollingops import RollingOpsCoordinator, RollingOpsManager
+from ops.charm import CharmBase
+from ops.framework import StoredState
+from ops.model import ActiveStatus, MaintenanceStatus, WaitingStatus
+from ops.testing import Harness
+
+METADATA = """
+name: rolling-coordinator
+provides:
+    rolling-ops:
+        interface: rolling_op_coordinator
+"""
+
+COORDINATED_METADATA = """
+name: kafka
+peers:
+    restart:
+        interface: rolling_op
+requires:
+    coordinator:
+        interface: rolling_op_coordinator
+        limit: 1
+"""
+
+# Related applications, and their number of units.
+APPS = {"kafka": 2, "zookeeper": 2, "consumer": 1}
+
+
+class CoordinatorCharm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+        self.coordinator = RollingOpsCoordinator(
+            charm=self, relation="rolling-ops", budget=2, limits={"kafka": 1}
+        )
+
+
+class CoordinatedCharm(CharmBase):
+    _stored = StoredState()
+
+    def __init__(self, *args):
+        super().__init__(*args)
+
+        self.restart_manager = RollingOpsManager(
+            charm=self, relation="restart", callback=self._restart, coordinator="coordinator"
+        )
+        self._stored.set_default(restarted=False)
+
+    def _restart(self, event):
+        self._stored.restarted = True
+
+
+class TestCoordinator(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(CoordinatorCharm, meta=METADATA)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.begin()
+
+        self.rel_ids = {}
+        for app, count in APPS.items():
+            rel_id = self.harness.add_relation("rolling-ops", app)
+            self.rel_ids[app] = rel_id
+            for i in range(count):
+                self.harness.add_relation_unit(rel_id, "{}/{}".format(app, i))
+
+    def _grants(self):
+        """Return the names of the units currently granted a lock."""
+        granted = []
+        for app, rel_id in self.rel_ids.items():
+            relation = self.harness.model.get_relation("rolling-ops", rel_id)
+            for unit in relation.units:
+                if relation.data[self.harness.model.app].get(unit.name) == "granted":
+                    granted.append(unit.name)
+        return sorted(granted)
+
+    def test_budget(self):
+        # Every unit of every application asks for the lock.
+        for app, rel_id in self.rel_ids.items():
+            for i in range(APPS[app]):
+                unit = "{}/{}".format(app, i)
+                self.harness.update_relation_data(rel_id, unit, {"state": "acquire"})
+
+        # Only two units run at once, and never two kafka units.
+        self.assertEqual(
+            self.harness.model.app.status,
+            MaintenanceStatus("Coordinating rolling-ops (2/2 units)"),
+        )
+        self.assertEqual(self._grants(), ["kafka/0", "zookeeper/0"])
+
+        # kafka/0 finishes. kafka/1 takes its place.
+        self.harness.update_relation_data(self.rel_ids["kafka"], "kafka/0", {"state": "release"})
+        self.assertEqual(self._grants(), ["kafka/1", "zookeeper/0"])
+
+        # zookeeper/0 finishes. zookeeper/1 is next in line.
+        self.harness.update_relation_data(
+            self.rel_ids["zookeeper"], "zookeeper/0", {"state": "release"}
+        )
+        self.assertEqual(self._grants(), ["kafka/1", "zookeeper/1"])
+
+        # Both finish. The consumer gets its turn.
+        self.harness.update_relation_data(self.rel_ids["kafka"], "kafka/1", {"state": "release"})
+        self.harness.update_relation_data(
+            self.rel_ids["zookeeper"], "zookeeper/1", {"state": "release"}
+        )
+        self.assertEqual(self._grants(), ["consumer/0"])
+
+        self.harness.update_relation_data(
+            self.rel_ids["consumer"], "consumer/0", {"state": "release"}
+        )
+        self.assertEqual(self._grants(), [])
+        self.assertEqual(self.harness.model.app.status, ActiveStatus())
+
+    def test_departed_unit_frees_budget(self):
+        self.harness.update_relation_data(self.rel_ids["kafka"], "kafka/0", {"state": "acquire"})
+        self.harness.update_relation_data(
+            self.rel_ids["zookeeper"], "zookeeper/0", {"state": "acquire"}
+        )
+        self.harness.update_relation_data(
+            self.rel_ids["consumer"], "consumer/0", {"state": "acquire"}
+        )
+        self.assertEqual(self._grants(), ["kafka/0", "zookeeper/0"])
+
+        # kafka/0 goes away mid-operation. Its slot goes to the consumer.
+        self.harness.remove_relation_unit(self.rel_ids["kafka"], "kafka/0")
+        self.assertEqual(self._grants(), ["consumer/0", "zookeeper/0"])
+
+    def test_leader_elected(self):
+        # Requests arrive while another unit leads, and that leader goes away.
+        self.harness.set_leader(False)
+        self.harness.update_relation_data(self.rel_ids["kafka"], "kafka/0", {"state": "acquire"})
+        self.assertEqual(self._grants(), [])
+
+        # We take over, and pick up the pending request straight away.
+        self.harness.set_leader(True)
+        self.assertEqual(self._grants(), ["kafka/0"])
+
+    def test_update_status(self):
+        self.harness.set_leader(False)
+        self.harness.update_relation_data(self.rel_ids["kafka"], "kafka/0", {"state": "acquire"})
+
+        # Even if we missed the election, update-status catches up.
+        self.harness.disable_hooks()
+        self.harness.set_leader(True)
+        self.harness.enable_hooks()
+        self.assertEqual(self._grants(), [])
+
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self._grants(), ["kafka/0"])
+
+
+class TestCoordinated(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(CoordinatedCharm, meta=COORDINATED_METADATA)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin_with_initial_hooks()
+
+    def test_coordinated(self):
+        # Our leader must leave the lock to the coordinator, once there is one.
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation("coordinator", "rolling-coordinator")
+        self.harness.add_relation_unit(rel_id, "rolling-coordinator/0")
+
+        self.harness.charm.on["restart"].acquire_lock.emit()
+
+        unit = self.harness.charm.model.unit
+        rel_data = self.harness.charm.model.get_relation("coordinator").data
+        peer_data = self.harness.charm.model.get_relation("restart").data
+
+        self.assertEqual(rel_data[unit]["state"], "acquire")
+        self.assertNotIn(str(unit), peer_data[self.harness.model.app])
+        self.assertFalse(self.harness.charm._stored.restarted)
+        self.assertEqual(
+            self.harness.charm.model.unit.status, WaitingStatus("Awaiting restart operation")
+        )
+
+        # The coordinator grants us the lock.
+        self.harness.update_relation_data(rel_id, "rolling-coordinator", {unit.name: "granted"})
+
+        self.assertTrue(self.harness.charm._stored.restarted)
+        self.assertEqual(rel_data[unit]["state"], "release")
+        self.assertEqual(self.harness.charm.model.unit.status, ActiveStatus())